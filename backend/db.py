@@ -1,60 +1,135 @@
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base
 from sqlalchemy.pool import StaticPool
+from dotenv import load_dotenv
 import os
+import re
 import logging
-from urllib.parse import quote_plus
 
 logger = logging.getLogger(__name__)
 
-# Database connection components
-DB_USER = "postgres.wcujcwjtbcqsajbmrhrw"
-DB_PASSWORD = "Jedi@2911022545"
-DB_HOST = "aws-1-ap-southeast-1.pooler.supabase.com"
-DB_PORT = "5432"
-DB_NAME = "postgres"
-
-# URL encode the password to handle special characters
-encoded_password = quote_plus(DB_PASSWORD)
-
-# Build the connection string
-DATABASE_URL = os.getenv(
-    "DATABASE_URL", 
-    f"postgresql://{DB_USER}:{encoded_password}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-)
-
-# Connection pool configuration for security and performance
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,  # Verify connections before use
-    pool_recycle=3600,   # Recycle connections every hour
-    echo=False,          # Never log SQL in production
-    connect_args={
-        "sslmode": "require",
-        "connect_timeout": 10
-    } if "postgresql" in DATABASE_URL else {}
-)
-
-# Enable WAL mode for SQLite (if using SQLite)
-if "sqlite" in DATABASE_URL:
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.execute("PRAGMA journal_mode=WAL")
-        cursor.close()
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+load_dotenv()
+
+# Connection string, or an AWS Secrets Manager reference ("sm://<secret-id>")
+# whose SecretString is the connection string
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL must be set")
+
+SECRET_REF_PREFIX = "sm://"
+
+def _async_driver_url(url: str) -> str:
+    """Route plain driver URLs (as handed out by Supabase/Render) to the async drivers"""
+    url = re.sub(r"^postgres(ql)?://", "postgresql+asyncpg://", url)
+    if url.startswith("postgresql+asyncpg://"):
+        # asyncpg rejects libpq's sslmode; TLS is always required via connect_args
+        url = make_url(url).difference_update_query(["sslmode"]).render_as_string(hide_password=False)
+    return re.sub(r"^sqlite://", "sqlite+aiosqlite://", url)
+
+DATABASE_URL = _async_driver_url(DATABASE_URL)
+
+# Pool sizing, tunable per deployment (SQLAlchemy's 5/10 default starves
+# concurrent logins behind the Supabase pooler)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle connections before the Supabase pooler's ~10 minute idle timeout
+# instead of pinging (BEGIN/ROLLBACK) on every checkout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "540"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() not in ("0", "false", "no")
+
+def _create_engine(url: str):
+    """Build the async engine with pool configuration for security and performance"""
+    new_engine = create_async_engine(
+        url,
+        pool_pre_ping=DB_POOL_PRE_PING,  # Verify connections before use
+        pool_recycle=DB_POOL_RECYCLE,    # Recycle before the pooler's idle timeout
+        echo=False,                      # Never log SQL in production
+        query_cache_size=1200,           # Compiled statement cache (default 500)
+        **({
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "connect_args": {
+                "ssl": "require",
+                "timeout": 10
+            }
+        } if "postgresql" in url else {})
+    )
+    
+    # Enable WAL mode for SQLite (if using SQLite)
+    if "sqlite" in url:
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+    
+    return new_engine
+
+async def resolve_database_url() -> str:
+    """Return DATABASE_URL, fetching it from Secrets Manager if it is a secret reference"""
+    if not DATABASE_URL.startswith(SECRET_REF_PREFIX):
+        return DATABASE_URL
+    
+    try:
+        import aioboto3
+    except ImportError:
+        raise RuntimeError("DATABASE_URL is a Secrets Manager reference but aioboto3 is not installed")
+    
+    secret_id = DATABASE_URL[len(SECRET_REF_PREFIX):]
+    async with aioboto3.Session().client("secretsmanager") as client:
+        secret = await client.get_secret_value(SecretId=secret_id)
+    return _async_driver_url(secret["SecretString"])
+
+# Built at import for a plain URL; a secret reference is resolved once by
+# init_engine() at startup
+engine = None if DATABASE_URL.startswith(SECRET_REF_PREFIX) else _create_engine(DATABASE_URL)
+
+class ReconnectingSession(AsyncSession):
+    """AsyncSession that retries a transaction's first statement once on disconnect
+    
+    Without pre-ping, a pooled connection the server already dropped only
+    shows up as an error on first use. SQLAlchemy invalidates the pool on
+    disconnect errors, so one retry runs on a fresh connection. Later
+    statements are never retried since earlier work in the transaction
+    would be lost.
+    """
+    
+    async def execute(self, statement, params=None, **kwargs):
+        opens_transaction = not self.in_transaction()
+        try:
+            return await super().execute(statement, params, **kwargs)
+        except DBAPIError as e:
+            if not (opens_transaction and e.connection_invalidated) or self.new or self.dirty or self.deleted:
+                raise
+            logger.warning(f"Stale database connection, retrying once: {e.orig}")
+            await self.rollback()
+            return await super().execute(statement, params, **kwargs)
+
+SessionLocal = async_sessionmaker(bind=engine, class_=ReconnectingSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
+async def init_engine():
+    """Create the engine on first call (fetching the secret if needed) and bind sessions to it"""
+    global engine
+    if engine is None:
+        engine = _create_engine(await resolve_database_url())
+        SessionLocal.configure(bind=engine)
+    return engine
+
+async def get_db():
     """Dependency for database sessions with proper cleanup"""
     db = SessionLocal()
     try:
         yield db
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Database error: {e}")
         raise
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
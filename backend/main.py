@@ -1,9 +1,12 @@
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from routes.auth import router as auth_router
 from routes.mfa import router as mfa_router
-from db import Base, engine
+from db import Base, init_engine
+from utils.security import security_logger, redis_client, warmup
+from utils.middleware import FastCORSMiddleware, FastTrustedHostMiddleware, SecurityHeadersMiddleware, AuthMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+from pydantic import BaseModel
 from dotenv import load_dotenv
 import logging
 import os
@@ -20,33 +23,52 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One engine per process; resolves a Secrets Manager DATABASE_URL here
+    # rather than on the first request
+    engine = app.state.engine = await init_engine()
+    
+    # Schema is managed by Alembic (`alembic upgrade head` on deploy); only
+    # local development bootstraps tables directly
+    if os.getenv("ENVIRONMENT") == "development":
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    
+    # Crypto lazy-init per worker, off the event loop (includes one Argon2 verify)
+    await asyncio.to_thread(warmup)
+    security_logger.start()
+    yield
+    await security_logger.stop()
+    if redis_client is not None:
+        await redis_client.aclose()
+    await engine.dispose()
 
 app = FastAPI(
     title="Secure Auth API",
+    lifespan=lifespan,
     docs_url="/docs" if os.getenv("ENVIRONMENT") == "development" else None,
     redoc_url="/redoc" if os.getenv("ENVIRONMENT") == "development" else None
 )
 
+class HealthResponse(BaseModel):
+    message: str
+    status: str
+
 # Root endpoint for health check
-@app.get("/")
-def root():
-    return {"message": "Secure MFA API is running", "status": "healthy"}
+@app.get("/", response_model=HealthResponse)
+async def root():
+    return HealthResponse(message="Secure MFA API is running", status="healthy")
+
+# Bearer token resolution (innermost: only runs for requests that passed the checks below)
+app.add_middleware(AuthMiddleware)
 
 # Security headers middleware
-@app.middleware("http")
-async def add_security_headers(request, call_next):
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = "default-src 'self'; style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net"
-    return response
+app.add_middleware(SecurityHeadersMiddleware)
 
 # Trusted host middleware (prevent Host header injection) - Updated for Render
 app.add_middleware(
-    TrustedHostMiddleware, 
+    FastTrustedHostMiddleware, 
     allowed_hosts=[
         "localhost", 
         "127.0.0.1",
@@ -55,16 +77,23 @@ app.add_middleware(
     ]
 )
 
+# Allowed CORS origins, built once at import (extra origins via ALLOWED_ORIGINS)
+ALLOWED_ORIGINS = frozenset(filter(None, (
+    origin.strip() for origin in [
+        "http://localhost:3000",
+        "https://secure-mfa-login-system.vercel.app",
+        *os.getenv("ALLOWED_ORIGINS", "").split(",")
+    ]
+)))
+
 # CORS with secure configuration
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "https://secure-mfa-login-system.vercel.app"
-    ],
+    FastCORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,  # Let browsers cache preflight results for 24h
 )
 
 app.include_router(auth_router, prefix="/auth")
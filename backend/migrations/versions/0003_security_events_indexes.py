@@ -0,0 +1,30 @@
+"""security_events user/type + timestamp indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-15 06:18:44.502917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_sec_events_user_ts', 'security_events', ['user_id', sa.text('timestamp DESC')], unique=False)
+    op.create_index('ix_sec_events_type_ts', 'security_events', ['event_type', sa.text('timestamp DESC')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sec_events_type_ts', table_name='security_events')
+    op.drop_index('ix_sec_events_user_ts', table_name='security_events')
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, Boolean, DateTime, Text, Integer
+from sqlalchemy import Column, String, Boolean, DateTime, Text, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from db import Base
@@ -30,6 +30,10 @@ class User(Base):
     # Email verification
     email_verified = Column(Boolean, default=False, nullable=False)
     email_verification_token = Column(String(255), nullable=True)
+    
+    __table_args__ = (
+        Index("ix_users_email_lower", func.lower(email)),  # Case-insensitive login lookup
+    )
 
 class SecurityEvent(Base):
     """Audit log for security events"""
@@ -41,4 +45,9 @@ class SecurityEvent(Base):
     ip_address = Column(String(45), nullable=True)  # IPv6 compatible
     user_agent = Column(Text, nullable=True)
     details = Column(Text, nullable=True)  # JSON string with additional details
-    timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
\ No newline at end of file
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index("ix_sec_events_user_ts", user_id, timestamp.desc()),  # Per-user audit history
+        Index("ix_sec_events_type_ts", event_type, timestamp.desc()),  # Event type within a time window
+    )
@@ -1,20 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, case, func, bindparam
+from sqlalchemy.orm import load_only
+from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
 from typing import Optional
 from models import User
 from utils.security import (
     password_validator, secure_hasher, jwt_manager, rate_limiter, 
-    security_logger, totp_manager, get_current_user
+    security_logger, totp_manager, get_current_user_id, invalidate_user_cache,
+    invalidate_totp_cache, token_subject, TotpCode, DUMMY_PASSWORD_HASH
 )
 from pydantic import BaseModel, EmailStr, validator
 from datetime import datetime, timezone, timedelta
 import re
+import uuid
 
 router = APIRouter()
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 15  # set your expiry here
 
+# Statements built once at import; values are bound per call
+_USER_ID_BY_EMAIL = select(User.id).where(func.lower(User.email) == bindparam("email"))
+# Only fetch the columns the login path reads
+_LOGIN_USER_BY_EMAIL = (
+    select(User)
+    .options(load_only(
+        User.id, User.password_hash, User.mfa_enabled, User.mfa_secret_encrypted,
+        User.account_locked_until, User.failed_login_attempts, User.last_totp_used_at
+    ))
+    .where(func.lower(User.email) == bindparam("email"))
+)
+_USER_BY_ID = select(User).where(User.id == bindparam("user_id"))
+
 # ---------------------------
 # Request / Response Schemas
 # ---------------------------
@@ -39,7 +56,7 @@ class SignupRequest(BaseModel):
 class LoginRequest(BaseModel):
     email: EmailStr
     password: str
-    totp_code: Optional[str] = None
+    totp_code: Optional[TotpCode] = None
     
     @validator('email')
     def validate_email(cls, v):
@@ -53,48 +70,56 @@ class TokenResponse(BaseModel):
     mfa_enabled: bool
     requires_mfa: bool = False
 
+class AccessTokenResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+class MessageResponse(BaseModel):
+    message: str
+
 
 # ---------------------------
 # Routes
 # ---------------------------
 
-@router.post("/signup", status_code=status.HTTP_201_CREATED)
+@router.post("/signup", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def signup(
     data: SignupRequest, 
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Secure user registration with validation"""
     
-    client_ip = security_logger._get_client_ip(request)
-    if rate_limiter.is_rate_limited(f"signup_{client_ip}", max_attempts=3, window_minutes=60):
+    signup_key = "signup_" + security_logger._get_client_ip(request)
+    if await rate_limiter.is_rate_limited(signup_key, max_attempts=3, window_minutes=60):
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Too many registration attempts. Try again later."
         )
     
-    existing_user = db.query(User).filter(User.email == data.email).first()
+    existing_user = (await db.execute(_USER_ID_BY_EMAIL, {"email": data.email})).scalar_one_or_none()
     if existing_user:
-        security_logger.log_security_event(db, None, "signup_existing_email", request, data.email)
-        rate_limiter.record_failed_attempt(f"signup_{client_ip}")
+        security_logger.log_security_event(None, "signup_existing_email", request, data.email)
+        await rate_limiter.record_failed_attempt(signup_key)
         raise HTTPException(status_code=400, detail="Registration failed")
     
     try:
         user = User(
             email=data.email,
-            password_hash=secure_hasher.hash_password(data.password),
+            password_hash=await secure_hasher.hash_password_async(data.password),
             email_verified=False
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         
-        security_logger.log_security_event(db, str(user.id), "user_registered", request)
+        security_logger.log_security_event(user.id, "user_registered", request)
         
-        return {"message": "Registration successful. Please verify your email."}
+        return MessageResponse(message="Registration successful. Please verify your email.")
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         security_logger.logger.error(f"Registration error: {e}")
         raise HTTPException(status_code=500, detail="Registration failed")
 
@@ -102,43 +127,58 @@ async def signup(
 async def login(
     data: LoginRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Login with MFA support"""
     
-    client_ip = security_logger._get_client_ip(request)
+    now = datetime.now(timezone.utc)  # Single timestamp for every check/write below
+    ip_key = "login_" + security_logger._get_client_ip(request)
+    email_key = "login_email_" + data.email
     
-    if rate_limiter.is_rate_limited(f"login_{client_ip}", max_attempts=10, window_minutes=15):
+    ip_limited, email_limited = await rate_limiter.check_many([(ip_key, 10, 15), (email_key, 5, 15)])
+    
+    if ip_limited:
         raise HTTPException(status_code=429, detail="Too many login attempts from this IP. Try again later.")
     
-    if rate_limiter.is_rate_limited(f"login_email_{data.email}", max_attempts=5, window_minutes=15):
+    if email_limited:
         raise HTTPException(status_code=429, detail="Too many login attempts for this account. Try again later.")
     
-    user = db.query(User).filter(User.email == data.email).first()
+    user = (await db.execute(_LOGIN_USER_BY_EMAIL, {"email": data.email})).scalar_one_or_none()
     
-    password_valid = False
-    if user:
-        password_valid = secure_hasher.verify_password(data.password, user.password_hash)
-    else:
-        secure_hasher.verify_password(data.password, "$2b$12$dummy.hash.to.prevent.timing.attacks")
+    # Always run one hash verification, against a dummy hash for unknown users
+    password_valid = await secure_hasher.verify_password_async(
+        data.password, user.password_hash if user else DUMMY_PASSWORD_HASH
+    )
     
-    if user and user.account_locked_until and user.account_locked_until > datetime.now(timezone.utc):
-        security_logger.log_security_event(db, str(user.id), "login_attempt_locked_account", request)
+    if user and user.account_locked_until and user.account_locked_until > now:
+        security_logger.log_security_event(user.id, "login_attempt_locked_account", request)
         raise HTTPException(status_code=423, detail="Account is temporarily locked")
     
     if not user or not password_valid:
-        rate_limiter.record_failed_attempt(f"login_{client_ip}")
-        rate_limiter.record_failed_attempt(f"login_email_{data.email}")
+        await rate_limiter.record_many([ip_key, email_key])
         
         if user:
-            user.failed_login_attempts += 1
-            if user.failed_login_attempts >= 5:
-                user.account_locked_until = datetime.now(timezone.utc) + timedelta(hours=1)
-                security_logger.log_security_event(db, str(user.id), "account_locked_failed_attempts", request)
-            db.commit()
-            security_logger.log_security_event(db, str(user.id), "login_failed_invalid_credentials", request)
+            # Increment and conditionally lock in a single atomic UPDATE
+            failed_attempts = (await db.execute(
+                update(User)
+                .where(User.id == user.id)
+                .values(
+                    failed_login_attempts=User.failed_login_attempts + 1,
+                    account_locked_until=case(
+                        (User.failed_login_attempts + 1 >= 5, now + timedelta(hours=1)),
+                        else_=User.account_locked_until
+                    )
+                )
+                .returning(User.failed_login_attempts)
+                .execution_options(synchronize_session=False)
+            )).scalar_one()
+            await db.commit()
+            if failed_attempts >= 5:
+                invalidate_user_cache(user.id)
+                security_logger.log_security_event(user.id, "account_locked_failed_attempts", request)
+            security_logger.log_security_event(user.id, "login_failed_invalid_credentials", request)
         else:
-            security_logger.log_security_event(db, None, "login_failed_user_not_found", request, data.email)
+            security_logger.log_security_event(None, "login_failed_user_not_found", request, data.email)
         
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
@@ -155,36 +195,41 @@ async def login(
                 requires_mfa=True
             )
         
-        # Validate format
-        if not data.totp_code.isdigit() or len(data.totp_code) != 6:
-            raise HTTPException(status_code=422, detail="TOTP code must be 6 digits")
-        
         # Verify TOTP
-        if not totp_manager.verify_totp(
+        if not await totp_manager.verify_totp(
             user.mfa_secret_encrypted, 
             data.totp_code, 
-            str(user.id),
-            user.last_totp_used_at
+            user.id,
+            user.last_totp_used_at,
+            now.timestamp()
         ):
-            rate_limiter.record_failed_attempt(f"totp_{user.id}")
-            security_logger.log_security_event(db, str(user.id), "login_failed_invalid_totp", request)
+            await rate_limiter.record_failed_attempt("totp_" + str(user.id))
+            security_logger.log_security_event(user.id, "login_failed_invalid_totp", request)
             raise HTTPException(status_code=401, detail="Invalid TOTP code")
-        
-        user.last_totp_used_at = datetime.now(timezone.utc)
     
     # ---------------------------
     # Success
     # ---------------------------
-    user.failed_login_attempts = 0
-    user.account_locked_until = None
-    user.last_login = datetime.now(timezone.utc)
-    db.commit()
+    values = {"failed_login_attempts": 0, "account_locked_until": None, "last_login": now}
+    if user.mfa_enabled:
+        values["last_totp_used_at"] = now
+    if secure_hasher.needs_rehash(user.password_hash):
+        # Upgrade legacy bcrypt hashes while the plaintext is at hand
+        values["password_hash"] = await secure_hasher.hash_password_async(data.password)
+    await db.execute(
+        update(User)
+        .where(User.id == user.id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    invalidate_user_cache(user.id)
     
     token_data = {"sub": str(user.id)}
     access_token = jwt_manager.create_access_token(token_data)
     refresh_token = jwt_manager.create_refresh_token(token_data)
     
-    security_logger.log_security_event(db, str(user.id), "login_successful", request)
+    security_logger.log_security_event(user.id, "login_successful", request)
     
     return TokenResponse(
         access_token=access_token,
@@ -193,11 +238,11 @@ async def login(
         mfa_enabled=user.mfa_enabled
     )
 
-@router.post("/refresh")
+@router.post("/refresh", response_model=AccessTokenResponse)
 async def refresh_token(
     refresh_token: str,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Refresh access token"""
     try:
@@ -205,31 +250,30 @@ async def refresh_token(
         if payload.get("type") != "refresh":
             raise HTTPException(status_code=401, detail="Invalid token type")
         
-        user_id = payload.get("sub")
-        user = db.query(User).filter(User.id == user_id).first()
+        user = (await db.execute(_USER_BY_ID, {"user_id": token_subject(payload)})).scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         
         token_data = {"sub": str(user.id)}
         new_access_token = jwt_manager.create_access_token(token_data)
         
-        security_logger.log_security_event(db, str(user.id), "token_refreshed", request)
+        security_logger.log_security_event(user.id, "token_refreshed", request)
         
-        return {
-            "access_token": new_access_token,
-            "token_type": "bearer",
-            "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
-        }
+        return AccessTokenResponse(
+            access_token=new_access_token,
+            expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        )
     except Exception as e:
         security_logger.logger.error(f"Token refresh error: {e}")
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
-@router.post("/logout")
+@router.post("/logout", response_model=MessageResponse)
 async def logout(
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: uuid.UUID = Depends(get_current_user_id)
 ):
     """Logout with event logging"""
-    security_logger.log_security_event(db, str(current_user.id), "user_logout", request)
-    return {"message": "Successfully logged out"}
+    invalidate_user_cache(current_user_id)
+    invalidate_totp_cache(current_user_id)
+    security_logger.log_security_event(current_user_id, "user_logout", request)
+    return MessageResponse(message="Successfully logged out")
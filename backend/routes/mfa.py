@@ -1,37 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy import select, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
 from models import User
-from utils.security import totp_manager, get_current_user, security_logger
-from pydantic import BaseModel, validator
-from typing import List
+from utils.security import (
+    totp_manager, get_current_user, get_current_user_id, security_logger,
+    invalidate_totp_cache, TotpCode, QR_CODE_MEDIA_TYPE
+)
+from pydantic import BaseModel
+from typing import List, Optional
 import logging
+import uuid
 
 router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
+_MFA_STATUS_BY_ID = select(
+    User.mfa_enabled, User.mfa_backup_codes_hash.isnot(None)
+).where(User.id == bindparam("user_id"))
+
 class MFASetupResponse(BaseModel):
-    qr_code_base64: str
+    qr_code_base64: Optional[str] = None  # Omitted with include_qr=false (use GET /mfa/qr)
     backup_codes: List[str]
     secret: str  # Only for initial setup, remove after verification
 
+class MFAStatusResponse(BaseModel):
+    mfa_enabled: bool
+    has_backup_codes: bool
+
+class MessageResponse(BaseModel):
+    message: str
+
 class TOTPVerifyRequest(BaseModel):
-    totp_code: str
-    
-    @validator('totp_code')
-    def validate_totp(cls, v):
-        if not v.isdigit() or len(v) != 6:
-            raise ValueError('TOTP code must be 6 digits')
-        return v
+    totp_code: TotpCode
 
 @router.post("/setup", response_model=MFASetupResponse)
 async def setup_mfa(
     request: Request,
+    include_qr: bool = True,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Setup MFA with secure secret generation and backup codes"""
+    """Setup MFA with secure secret generation and backup codes
+    
+    include_qr=false skips the base64 QR code in the JSON body; clients then
+    fetch the image itself from GET /mfa/qr.
+    """
     
     if current_user.mfa_enabled:
         raise HTTPException(status_code=400, detail="MFA is already enabled")
@@ -47,19 +62,20 @@ async def setup_mfa(
         try:
             current_user.mfa_secret_encrypted = encrypted_secret
             current_user.mfa_backup_codes_hash = backup_codes_hash
-            db.commit()
+            await db.commit()
+            invalidate_totp_cache(current_user.id)
         except AttributeError as e:
             logger.error(f"Database schema issue: {e}")
             # Fallback: just generate QR code without storing
             pass
         
         # Generate QR code
-        qr_code_base64 = totp_manager.generate_qr_code(current_user.email, secret)
+        qr_code_base64 = totp_manager.generate_qr_code(current_user.email, secret) if include_qr else None
         
         # Log MFA setup initiation (optional)
         try:
             security_logger.log_security_event(
-                db, str(current_user.id), "mfa_setup_initiated", request
+                current_user.id, "mfa_setup_initiated", request
             )
         except Exception as e:
             logger.warning(f"Could not log security event: {e}")
@@ -71,16 +87,39 @@ async def setup_mfa(
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"MFA setup error: {e}")
         raise HTTPException(status_code=500, detail="MFA setup failed")
 
-@router.post("/verify")
+@router.get(
+    "/qr",
+    response_class=Response,
+    responses={200: {"content": {QR_CODE_MEDIA_TYPE: {}}}}
+)
+async def mfa_qr_code(
+    current_user: User = Depends(get_current_user)
+):
+    """QR code image for a pending MFA setup, served as-is (no base64/JSON)"""
+    
+    if current_user.mfa_enabled:
+        raise HTTPException(status_code=400, detail="MFA is already enabled")
+    
+    if not current_user.mfa_secret_encrypted:
+        raise HTTPException(status_code=400, detail="MFA setup not initiated")
+    
+    secret = totp_manager.decrypt_secret(current_user.mfa_secret_encrypted)
+    return Response(
+        content=totp_manager.generate_qr_code_bytes(current_user.email, secret),
+        media_type=QR_CODE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-store"}  # Encodes the TOTP secret
+    )
+
+@router.post("/verify", response_model=MessageResponse)
 async def verify_mfa_setup(
     data: TOTPVerifyRequest,
     request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Verify TOTP setup and enable MFA"""
     
@@ -91,33 +130,33 @@ async def verify_mfa_setup(
         raise HTTPException(status_code=400, detail="MFA setup not initiated")
     
     # Verify TOTP code
-    if not totp_manager.verify_totp(
+    if not await totp_manager.verify_totp(
         current_user.mfa_secret_encrypted, 
         data.totp_code, 
-        str(current_user.id)
+        current_user.id
     ):
         security_logger.log_security_event(
-            db, str(current_user.id), "mfa_verification_failed", request
+            current_user.id, "mfa_verification_failed", request
         )
         raise HTTPException(status_code=401, detail="Invalid TOTP code")
     
     # Enable MFA
     current_user.mfa_enabled = True
-    db.commit()
+    await db.commit()
     
     # Log MFA enablement
     security_logger.log_security_event(
-        db, str(current_user.id), "mfa_enabled", request
+        current_user.id, "mfa_enabled", request
     )
     
-    return {"message": "MFA successfully enabled"}
+    return MessageResponse(message="MFA successfully enabled")
 
-@router.post("/disable")
+@router.post("/disable", response_model=MessageResponse)
 async def disable_mfa(
     data: TOTPVerifyRequest,
     request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Disable MFA with TOTP verification"""
     
@@ -125,14 +164,14 @@ async def disable_mfa(
         raise HTTPException(status_code=400, detail="MFA is not enabled")
     
     # Verify current TOTP code before disabling
-    if not totp_manager.verify_totp(
+    if not await totp_manager.verify_totp(
         current_user.mfa_secret_encrypted, 
         data.totp_code, 
-        str(current_user.id),
+        current_user.id,
         current_user.last_totp_used_at
     ):
         security_logger.log_security_event(
-            db, str(current_user.id), "mfa_disable_failed", request
+            current_user.id, "mfa_disable_failed", request
         )
         raise HTTPException(status_code=401, detail="Invalid TOTP code")
     
@@ -141,22 +180,30 @@ async def disable_mfa(
     current_user.mfa_secret_encrypted = None
     current_user.mfa_backup_codes_hash = None
     current_user.last_totp_used_at = None
-    db.commit()
+    await db.commit()
+    invalidate_totp_cache(current_user.id)
     
     # Log MFA disablement
     security_logger.log_security_event(
-        db, str(current_user.id), "mfa_disabled", request
+        current_user.id, "mfa_disabled", request
     )
     
-    return {"message": "MFA successfully disabled"}
+    return MessageResponse(message="MFA successfully disabled")
 
-@router.get("/status")
+@router.get("/status", response_model=MFAStatusResponse)
 async def mfa_status(
-    current_user: User = Depends(get_current_user)
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get current MFA status"""
     
-    return {
-        "mfa_enabled": current_user.mfa_enabled,
-        "has_backup_codes": bool(current_user.mfa_backup_codes_hash)
-    }
\ No newline at end of file
+    # The id may come from the lock-state cache, so the row can be gone
+    row = (await db.execute(_MFA_STATUS_BY_ID, {"user_id": current_user_id})).one_or_none()
+    if row is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    mfa_enabled, has_backup_codes = row
+    return MFAStatusResponse(
+        mfa_enabled=mfa_enabled,
+        has_backup_codes=has_backup_codes
+    )
\ No newline at end of file
@@ -0,0 +1,14 @@
+import os
+import sys
+
+from cryptography.fernet import Fernet
+
+# utils.security and db validate their settings at import time
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["JWT_SECRET_KEY"] = "test-jwt-secret-key-0123456789abcdef"
+os.environ["TOTP_ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+os.environ["BACKUP_CODE_PEPPER"] = "test-backup-code-pepper"
+os.environ.pop("REDIS_URL", None)
+
+# Backend modules import each other top-level (from db import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import uuid
+
+import jwt
+import pyotp
+import pytest
+
+from utils.security import ALGORITHM, SECRET_KEY, jwt_manager, totp_manager
+
+# RFC 4226 appendix D / RFC 6238 appendix B (SHA-1) seed
+RFC_SEED = b"12345678901234567890"
+
+RFC4226_HOTP = [
+    b"755224", b"287082", b"359152", b"969429", b"338314",
+    b"254676", b"287922", b"162583", b"399871", b"520489",
+]
+
+# RFC 6238 SHA-1 vectors, reduced to the six digits we issue
+RFC6238_TOTP = [
+    (59, b"287082"),
+    (1111111109, b"081804"),
+    (1111111111, b"050471"),
+    (1234567890, b"005924"),
+    (2000000000, b"279037"),
+    (20000000000, b"353130"),
+]
+
+
+@pytest.mark.parametrize("counter,expected", list(enumerate(RFC4226_HOTP)))
+def test_hotp_rfc4226_vectors(counter, expected):
+    contexts = totp_manager._hmac_sha1_contexts(RFC_SEED)
+    assert totp_manager._hotp(contexts, counter) == expected
+
+
+@pytest.mark.parametrize("timestamp,expected", RFC6238_TOTP)
+def test_totp_rfc6238_sha1_vectors(timestamp, expected):
+    contexts = totp_manager._hmac_sha1_contexts(RFC_SEED)
+    assert totp_manager._hotp(contexts, timestamp // 30) == expected
+
+
+@pytest.mark.parametrize("key_length", [64, 65, 80, 131])
+def test_hotp_keys_longer_than_block_match_pyotp(key_length):
+    # HMAC hashes keys over the 64-byte SHA-1 block size before padding
+    key = bytes(range(key_length))
+    reference = pyotp.HOTP(base64.b32encode(key).decode())
+    contexts = totp_manager._hmac_sha1_contexts(key)
+    for counter in (0, 1, 59, 2**32):
+        assert totp_manager._hotp(contexts, counter) == reference.at(counter).encode()
+
+
+def test_verify_totp_accepts_current_code():
+    secret = "JBSWY3DPEHPK3PXPJBSWY3DPEHPK3PXP"
+    encrypted = totp_manager.encrypt_secret(secret)
+    now = 1_700_000_000.0
+    code = pyotp.TOTP(secret).at(now)
+    wrong = f"{(int(code) + 1) % 1_000_000:06d}"
+
+    async def verify(candidate, user):
+        return await totp_manager.verify_totp(encrypted, candidate, user, None, now)
+
+    assert asyncio.run(verify(code, uuid.uuid4()))
+    assert not asyncio.run(verify(wrong, uuid.uuid4()))
+
+
+def test_encoded_tokens_round_trip_through_pyjwt():
+    payload = {"sub": "7d0c6f1e-8a47-4c6a-9f43-2b1f0f8b9a10", "iat": 1700000000, "exp": 4102444800, "type": "access"}
+    token = jwt_manager._encode(payload)
+
+    assert jwt.get_unverified_header(token) == {"alg": ALGORITHM, "typ": "JWT"}
+    assert jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]) == payload
+
+
+def test_issued_tokens_decode_with_pyjwt():
+    data = {"sub": "7d0c6f1e-8a47-4c6a-9f43-2b1f0f8b9a10"}
+    access = jwt.decode(jwt_manager.create_access_token(data), SECRET_KEY, algorithms=[ALGORITHM])
+    refresh = jwt.decode(jwt_manager.create_refresh_token(data), SECRET_KEY, algorithms=[ALGORITHM])
+
+    assert (access["sub"], access["type"]) == (data["sub"], "access")
+    assert (refresh["sub"], refresh["type"]) == (data["sub"], "refresh")
+    assert jwt_manager.decode_token(jwt.encode({**access}, SECRET_KEY, algorithm=ALGORITHM)) == access
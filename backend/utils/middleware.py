@@ -0,0 +1,119 @@
+import re
+from typing import Optional
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.trustedhost import TrustedHostMiddleware
+from utils.security import access_token_subject
+
+# Host header as "reg-name[:port]" using Starlette's host characters. Only
+# headers in this shape take the fast path; IP literals and anything malformed
+# are left to TrustedHostMiddleware to parse and reject.
+_FAST_HOST_RE = re.compile(r"(?P<host>[a-z0-9._~%!$&'()*+,;=-]+)(?::(?P<port>[0-9]{1,5}))?", re.IGNORECASE)
+
+# Static security headers, encoded once in raw ASGI form
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"content-security-policy", b"default-src 'self'; style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net"),
+]
+
+
+class FastCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware with origin/method/header allow-lists frozen into sets
+
+    Starlette keeps these as the lists it was given and tests membership on
+    every request; freezing them once at construction makes each check O(1).
+    """
+    
+    def __init__(self, app, **kwargs):
+        super().__init__(app, **kwargs)
+        self.allow_origins = frozenset(self.allow_origins)
+        self.allow_methods = frozenset(self.allow_methods)
+        self.allow_headers = frozenset(self.allow_headers)
+
+
+class FastTrustedHostMiddleware(TrustedHostMiddleware):
+    """TrustedHostMiddleware with the allowed hosts split into exact and wildcard matchers
+
+    Starlette loops over the patterns on every request; here an allowed host is
+    checked with one set lookup and one str.endswith over the precomputed
+    suffixes. A malformed or non-matching Host falls through to Starlette,
+    which keeps its own validation, www redirect and 400 response.
+    """
+    
+    def __init__(self, app, allowed_hosts=None, www_redirect: bool = True):
+        super().__init__(app, allowed_hosts=allowed_hosts, www_redirect=www_redirect)
+        self._exact = frozenset(h for h in self.allowed_hosts if "*" not in h)
+        self._suffixes = tuple(h[1:] for h in self.allowed_hosts if h.startswith("*."))
+    
+    def _is_allowed(self, scope) -> bool:
+        match = _FAST_HOST_RE.fullmatch(Headers(scope=scope).get("host", ""))
+        if match is None or (match["port"] and int(match["port"]) > 65535):
+            return False
+        host = match["host"]
+        return host in self._exact or host.endswith(self._suffixes)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and self._is_allowed(scope):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+class SecurityHeadersMiddleware:
+    """Pure ASGI middleware adding SECURITY_HEADERS to every HTTP response
+
+    Avoids BaseHTTPMiddleware (@app.middleware("http")), which spawns a task
+    group and memory stream for each request.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *SECURITY_HEADERS]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+
+def _bearer_token(scope) -> Optional[str]:
+    """Token from the first raw Authorization header if it uses the Bearer scheme"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            if value[:7].lower() == b"bearer ":
+                return value[7:].decode("latin-1")
+            return None
+    return None
+
+
+class AuthMiddleware:
+    """Pure ASGI middleware resolving the bearer token once per request
+    
+    Sets scope["user_id"] for a valid access token, or scope["auth_error"] to
+    the HTTPException a protected route should raise. Requests are never
+    rejected here; get_current_user_id/get_current_user enforce auth.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            token = _bearer_token(scope)
+            if token is not None:
+                try:
+                    scope["user_id"] = access_token_subject(token)
+                except HTTPException as e:
+                    scope["auth_error"] = e
+        
+        await self.app(scope, receive, send)
@@ -1,23 +1,41 @@
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
 import jwt
 import pyotp
 import qrcode
+import qrcode.image.svg
 import io
 import base64
 import os
 import secrets
 import hashlib
 import hmac
+import asyncio
+import uuid
+import json
+import re
+import string
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Any, List
-from fastapi import Depends, HTTPException, status, Request
+from typing import Optional, Dict, Any, List, Tuple, Annotated
+from fastapi import Depends, HTTPException, Security, status, Request
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from cryptography.fernet import Fernet
-from db import get_db
+from pydantic import StringConstraints
+from sqlalchemy import select, insert, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cachetools import TTLCache
+from db import get_db, SessionLocal
 from models import User, SecurityEvent
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote, quote_plus
 import time
 from dotenv import load_dotenv
 import os
@@ -38,21 +56,160 @@ TOTP_ENCRYPTION_KEY = os.environ.get("TOTP_ENCRYPTION_KEY")
 if not TOTP_ENCRYPTION_KEY:
     raise ValueError("TOTP_ENCRYPTION_KEY must be set")
 
+# Key for the per-code backup code hashes (BLAKE2b keys are at most 64 bytes)
+BACKUP_CODE_PEPPER = os.environ.get("BACKUP_CODE_PEPPER")
+if not BACKUP_CODE_PEPPER:
+    raise ValueError("BACKUP_CODE_PEPPER must be set")
+_PEPPER = BACKUP_CODE_PEPPER.encode()[:64]
+
+# Legacy cipher for TOTP secrets stored before the switch to AES-GCM
 fernet = Fernet(TOTP_ENCRYPTION_KEY.encode())
 
+# AES-256-GCM key derived from the same Fernet-format key, so existing
+# deployments keep one secret and the two ciphers never share key bytes
+_AEAD = AESGCM(HKDF(
+    algorithm=hashes.SHA256(),
+    length=32,
+    salt=None,
+    info=b"totp-secret-aes-gcm"
+).derive(base64.urlsafe_b64decode(TOTP_ENCRYPTION_KEY)))
+_AEAD_VERSION = b"\x01"
+_AEAD_NONCE_SIZE = 12
+_FERNET_TOKEN_PREFIX = "gAAAAA"
+
 ALGORITHM = "HS256"
+_SIGNING_KEY = SECRET_KEY.encode()
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+# Every token we issue has the same header, so its encoded segment is built once
+_JWT_HEADER_SEGMENT = _b64url(json.dumps({"alg": ALGORITHM, "typ": "JWT"}, separators=(",", ":")).encode())
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
-# Rate limiting storage (use Redis in production)
-failed_attempts = defaultdict(list)
-totp_attempts = defaultdict(list)
+# TOTP code format check, compiled once (ASCII digits only)
+match_totp_code = re.compile(r"[0-9]{6}").fullmatch
+
+# Request field type for TOTP codes; validated inside pydantic-core
+TotpCode = Annotated[str, StringConstraints(min_length=6, max_length=6, pattern=r"^[0-9]{6}$")]
+
+# Rate limiting storage: Redis fixed-window counters shared by all workers
+# when REDIS_URL is set; the in-process lists are the fallback (and the
+# store for single-worker/development runs)
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    import redis.asyncio as aioredis
+    redis_client = aioredis.from_url(REDIS_URL, socket_timeout=0.25, socket_connect_timeout=0.25)
+else:
+    redis_client = None
+
+# Minute buckets live for the longest window in use (signup: 60 minutes)
+RATE_LIMIT_BUCKET_TTL = 61 * 60
+
+# Only the newest attempts matter for a "max_attempts within the window" check,
+# so each identifier keeps at most as many timestamps as the largest limit (login IP: 10).
+# Limits above this cap can never trip locally and are rejected by RateLimiter.
+RATE_LIMIT_MAX_TRACKED = 10
+failed_attempts = defaultdict(lambda: deque(maxlen=RATE_LIMIT_MAX_TRACKED))
+
+# Decoded JWT payloads keyed by a BLAKE2b digest of the token, kept for a few
+# seconds so bursts of requests with one token verify it once. Tokens close to
+# "exp" are never cached, so a hit can't outlive the token.
+decoded_token_cache = TTLCache(maxsize=4096, ttl=5)
+TOKEN_CACHE_EXP_MARGIN = 10
+
+def epoch_seconds(value: datetime) -> float:
+    """Unix time of a stored timestamp (naive values are UTC, as SQLite returns them)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+# Account lock state (account_locked_until as Unix time, or None) keyed by
+# user id, so routes that only need the caller's id skip the users lookup on
+# repeat requests
+user_lock_cache = TTLCache(maxsize=10000, ttl=30)
+
+# Opt-in (TOTP_SECRET_CACHE=true): keyed HMAC-SHA1 states per user id, so
+# repeat verifications skip the decrypt, base32 decode and key setup. Only the
+# hash states are held, never the decrypted secret; entries are tagged with
+# the ciphertext they came from and dropped on logout/MFA changes.
+TOTP_SECRET_CACHE = os.getenv("TOTP_SECRET_CACHE", "false").lower() not in ("0", "false", "no")
+totp_context_cache = TTLCache(maxsize=2048, ttl=300)
+TOTP_PERIOD = 30
+QR_CODE_MEDIA_TYPE = "image/svg+xml"
+
+# HMAC key pads as translate tables (byte -> byte ^ pad), as the hmac module builds them
+_HMAC_IPAD = bytes(b ^ 0x36 for b in range(256))
+_HMAC_OPAD = bytes(b ^ 0x5C for b in range(256))
+_MISSING = object()
+
+class _SchemaOnlyOAuth2(OAuth2PasswordBearer):
+    """Declares the bearer scheme in OpenAPI; the token itself is read from the
+    raw headers by AuthMiddleware, so nothing is parsed here"""
+    
+    async def __call__(self, request: Request) -> None:
+        return None
+
+oauth2_scheme = _SchemaOnlyOAuth2(tokenUrl="/auth/login", scheme_name="OAuth2PasswordBearer")
+
+# Columns the authenticated routes read or write on the current user;
+# password_hash and the rest stay unloaded (deferred, not lazy-loaded)
+_CURRENT_USER_LOAD = [load_only(
+    User.id, User.email, User.mfa_enabled, User.mfa_secret_encrypted,
+    User.mfa_backup_codes_hash, User.last_totp_used_at, User.account_locked_until,
+    raiseload=True
+)]
+_CURRENT_USER_BY_ID = select(User).options(*_CURRENT_USER_LOAD).where(User.id == bindparam("user_id"))
+_USER_LOCK_BY_ID = select(User.account_locked_until).where(User.id == bindparam("user_id"))
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+# Character class bits for password validation
+CHAR_UPPER, CHAR_LOWER, CHAR_DIGIT, CHAR_SPECIAL = 1, 2, 4, 8
+_SPECIAL = frozenset("!@#$%^&*()_+-=[]{}|;:,.<>?")
+
+def _char_class_table() -> bytes:
+    """bytes.translate table mapping each ASCII byte to its class bit (0 if none)"""
+    table = bytearray(256)
+    for chars, bit in (
+        (string.ascii_uppercase, CHAR_UPPER),
+        (string.ascii_lowercase, CHAR_LOWER),
+        (string.digits, CHAR_DIGIT),
+        (_SPECIAL, CHAR_SPECIAL),
+    ):
+        for c in chars:
+            table[ord(c)] = bit
+    return bytes(table)
+
+_CHAR_CLASS_TABLE = _char_class_table()
+
+# Check for common passwords (implement your own list)
+COMMON_PASSWORDS = frozenset(["password123", "123456789", "qwerty123"])
 
 class PasswordValidator:
     """Secure password validation"""
     
+    @staticmethod
+    def _char_classes(password: str) -> int:
+        """Bitmask of the character classes present in password"""
+        mask = 0
+        if password.isascii():
+            # translate() classifies every byte in one C loop; the set holds at most 5 values
+            for bit in set(password.encode().translate(_CHAR_CLASS_TABLE)):
+                mask |= bit
+            return mask
+        
+        # Unicode letters/digits count too, via the str predicates
+        chars = set(password)
+        if any(c.isupper() for c in chars):
+            mask |= CHAR_UPPER
+        if any(c.islower() for c in chars):
+            mask |= CHAR_LOWER
+        if any(c.isdigit() for c in chars):
+            mask |= CHAR_DIGIT
+        if not _SPECIAL.isdisjoint(chars):
+            mask |= CHAR_SPECIAL
+        return mask
+    
     @staticmethod
     def validate_password(password: str) -> Dict[str, Any]:
         errors = []
@@ -60,168 +217,299 @@ class PasswordValidator:
         if len(password) < 12:
             errors.append("Password must be at least 12 characters long")
         
-        if not any(c.isupper() for c in password):
+        mask = PasswordValidator._char_classes(password)
+        
+        if not mask & CHAR_UPPER:
             errors.append("Password must contain at least one uppercase letter")
         
-        if not any(c.islower() for c in password):
+        if not mask & CHAR_LOWER:
             errors.append("Password must contain at least one lowercase letter")
         
-        if not any(c.isdigit() for c in password):
+        if not mask & CHAR_DIGIT:
             errors.append("Password must contain at least one digit")
         
-        if not any(c in "!@#$%^&*()_+-=[]{}|;:,.<>?" for c in password):
+        if not mask & CHAR_SPECIAL:
             errors.append("Password must contain at least one special character")
         
-        # Check for common passwords (implement your own list)
-        common_passwords = ["password123", "123456789", "qwerty123"]
-        if password.lower() in common_passwords:
+        if password.lower() in COMMON_PASSWORDS:
             errors.append("Password is too common")
         
         return {"valid": len(errors) == 0, "errors": errors}
 
+# Argon2id tuned to bcrypt-12 verify time (~0.3s) so legacy bcrypt accounts,
+# migrated accounts and unknown emails (DUMMY_PASSWORD_HASH) all cost the same.
+# Single lane, like bcrypt, so the match holds regardless of core count.
+# 64 MiB per hash in flight.
+_ARGON2 = PasswordHasher(time_cost=6, memory_cost=64 * 1024, parallelism=1)
+ARGON2_PREFIX = "$argon2"
+
+# Hashes run on their own small pool rather than asyncio.to_thread's default
+# executor (up to 32 threads), capping Argon2 memory at workers x 64 MiB
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+_PASSWORD_HASH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+
 class SecureHasher:
-    """Secure password hashing with bcrypt"""
+    """Secure password hashing with Argon2id (bcrypt hashes verified for migration)"""
     
     @staticmethod
     def hash_password(password: str) -> str:
-        # Use cost factor of 12 (2^12 = 4096 rounds)
-        salt = bcrypt.gensalt(rounds=12)
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        return _ARGON2.hash(password)
     
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         try:
+            if hashed_password.startswith(ARGON2_PREFIX):
+                return _ARGON2.verify(hashed_password, plain_password)
+            # Legacy bcrypt hash ($2b$...)
             return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        except VerifyMismatchError:
+            return False
         except Exception as e:
             logger.error(f"Password verification error: {e}")
             return False
+    
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        """True for bcrypt hashes and Argon2 hashes with outdated parameters"""
+        return not hashed_password.startswith(ARGON2_PREFIX) or _ARGON2.check_needs_rehash(hashed_password)
+    
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """hash_password on the hashing pool so it doesn't block the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            _PASSWORD_HASH_EXECUTOR, SecureHasher.hash_password, password
+        )
+    
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        """verify_password on the hashing pool so it doesn't block the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            _PASSWORD_HASH_EXECUTOR, SecureHasher.verify_password, plain_password, hashed_password
+        )
+
+# Real hash of a random password, verified against when the user doesn't exist
+# so unknown emails cost the same time as wrong passwords
+DUMMY_PASSWORD_HASH = SecureHasher.hash_password(secrets.token_urlsafe(32))
 
 class TOTPManager:
     """Secure TOTP management with encryption"""
     
-    def __init__(self):
-        self.fernet = Fernet(TOTP_ENCRYPTION_KEY.encode())
-    
     def generate_secret(self) -> str:
         """Generate cryptographically secure TOTP secret"""
         return pyotp.random_base32()
     
     def encrypt_secret(self, secret: str) -> str:
-        """Encrypt TOTP secret for storage"""
-        return self.fernet.encrypt(secret.encode()).decode()
+        """Encrypt TOTP secret for storage (version byte + nonce + AES-GCM ciphertext)"""
+        nonce = os.urandom(_AEAD_NONCE_SIZE)
+        return base64.b64encode(_AEAD_VERSION + nonce + _AEAD.encrypt(nonce, secret.encode(), None)).decode()
     
     def decrypt_secret(self, encrypted_secret: str) -> str:
-        """Decrypt TOTP secret"""
+        """Decrypt TOTP secret, accepting legacy Fernet tokens"""
         try:
-            return self.fernet.decrypt(encrypted_secret.encode()).decode()
+            if encrypted_secret.startswith(_FERNET_TOKEN_PREFIX):
+                return fernet.decrypt(encrypted_secret.encode()).decode()
+            
+            token = base64.b64decode(encrypted_secret)
+            if token[:1] != _AEAD_VERSION:
+                raise InvalidToken
+            nonce = token[1:1 + _AEAD_NONCE_SIZE]
+            return _AEAD.decrypt(nonce, token[1 + _AEAD_NONCE_SIZE:], None).decode()
         except Exception as e:
             logger.error(f"TOTP secret decryption error: {e}")
             raise HTTPException(status_code=500, detail="Internal server error")
     
-    def verify_totp(self, encrypted_secret: str, code: str, user_id: str, last_used: Optional[datetime] = None) -> bool:
-        """Verify TOTP with replay attack prevention"""
-        if not code.isdigit() or len(code) != 6:
+    async def verify_totp(
+        self,
+        encrypted_secret: str,
+        code: str,
+        user_id: uuid.UUID,
+        last_used: Optional[datetime] = None,
+        now: Optional[float] = None
+    ) -> bool:
+        """Verify TOTP with replay attack prevention (now: Unix time, defaults to time.time())"""
+        if not match_totp_code(code):
             return False
         
-        # Rate limiting for TOTP attempts
-        now = time.time()
-        user_attempts = totp_attempts[user_id]
-        # Remove attempts older than 5 minutes
-        user_attempts[:] = [attempt for attempt in user_attempts if now - attempt < 300]
-        
-        if len(user_attempts) >= 5:  # Max 5 attempts per 5 minutes
+        # Rate limiting for TOTP attempts: max 5 attempts per 5 minutes
+        if await RateLimiter.hit(f"totp_attempt_{user_id}", max_attempts=5, window_minutes=5):
             logger.warning(f"TOTP rate limit exceeded for user {user_id}")
             return False
         
-        user_attempts.append(now)
-        
         try:
-            secret = self.decrypt_secret(encrypted_secret)
-            totp = pyotp.TOTP(secret)
+            contexts = self._totp_contexts(user_id, encrypted_secret)
             
             # Check for replay attacks
-            if last_used and self._is_recent_use(last_used):
+            if last_used and self._is_recent_use(last_used, now):
                 logger.warning(f"Potential TOTP replay attack for user {user_id}")
                 return False
             
-            # Verify with 1 window tolerance (30 seconds before/after)
-            return totp.verify(code, valid_window=1)
+            # Verify with 1 window tolerance (30 seconds before/after); every
+            # window is compared so timing doesn't reveal which one matched
+            counter = int(now or time.time()) // TOTP_PERIOD
+            code_bytes = code.encode()
+            matched = False
+            for c in (counter - 1, counter, counter + 1):
+                matched |= hmac.compare_digest(self._hotp(contexts, c), code_bytes)
+            return matched
         
         except Exception as e:
             logger.error(f"TOTP verification error: {e}")
             return False
     
-    def _is_recent_use(self, last_used: datetime) -> bool:
+    def _totp_key(self, encrypted_secret: str) -> bytes:
+        """Raw HMAC key for a stored secret"""
+        secret = self.decrypt_secret(encrypted_secret)
+        return base64.b32decode(secret + "=" * (-len(secret) % 8), casefold=True)
+    
+    def _totp_contexts(self, user_id: uuid.UUID, encrypted_secret: str) -> Tuple[Any, Any]:
+        """HMAC-SHA1 states for a user's secret, from totp_context_cache when enabled"""
+        if TOTP_SECRET_CACHE:
+            cached = totp_context_cache.get(user_id)
+            if cached is not None and cached[0] == encrypted_secret:
+                return cached[1]
+        
+        contexts = self._hmac_sha1_contexts(self._totp_key(encrypted_secret))
+        if TOTP_SECRET_CACHE:
+            totp_context_cache[user_id] = (encrypted_secret, contexts)
+        return contexts
+    
+    @staticmethod
+    def _hmac_sha1_contexts(key: bytes) -> Tuple[Any, Any]:
+        """SHA-1 states with the HMAC ipad/opad key blocks already absorbed
+        
+        Each HOTP value then only clones these states (in C) instead of
+        redoing the key setup per window.
+        """
+        if len(key) > 64:
+            key = hashlib.sha1(key).digest()
+        key = key.ljust(64, b"\0")
+        inner = hashlib.sha1(key.translate(_HMAC_IPAD))
+        outer = hashlib.sha1(key.translate(_HMAC_OPAD))
+        return inner, outer
+    
+    @staticmethod
+    def _hotp(contexts: Tuple[Any, Any], counter: int) -> bytes:
+        """RFC 4226 six-digit code for one counter value (RFC 6238 with a 30s step)"""
+        inner, outer = contexts[0].copy(), contexts[1].copy()
+        inner.update(counter.to_bytes(8, "big"))
+        outer.update(inner.digest())
+        digest = outer.digest()
+        offset = digest[19] & 0x0F
+        value = int.from_bytes(digest[offset:offset + 4], "big") & 0x7FFFFFFF
+        return b"%06d" % (value % 1_000_000)
+    
+    def _is_recent_use(self, last_used: datetime, now: Optional[float] = None) -> bool:
         """Check if TOTP was used recently (replay attack prevention)"""
         if not last_used:
             return False
         
-        time_diff = datetime.now(timezone.utc) - last_used.replace(tzinfo=timezone.utc)
-        return time_diff < timedelta(seconds=90)  # 90 second window
+        time_diff = (now or time.time()) - epoch_seconds(last_used)
+        return time_diff < 90  # 90 second window
     
-    def generate_qr_code(self, email: str, secret: str, issuer: str = "SecureApp") -> str:
-        """Generate QR code for TOTP setup"""
-        uri = pyotp.totp.TOTP(secret).provisioning_uri(
-            name=email,
-            issuer_name=issuer
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _provisioning_uri_template(issuer: str) -> str:
+        """otpauth:// URI with {label}/{secret} placeholders, encoded as pyotp does"""
+        return (
+            "otpauth://totp/" + quote(issuer) + ":{label}?secret={secret}&issuer="
+            + quote_plus(issuer).replace("+", "%20")
         )
-        
+    
+    def provisioning_uri(self, email: str, secret: str, issuer: str = "SecureApp") -> str:
+        """Authenticator app provisioning URI (same output as pyotp's provisioning_uri)"""
+        return self._provisioning_uri_template(issuer).format(label=quote(email), secret=secret)
+    
+    def generate_qr_code_bytes(self, email: str, secret: str, issuer: str = "SecureApp") -> bytes:
+        """Generate QR code for TOTP setup (SVG document, QR_CODE_MEDIA_TYPE)"""
         qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(uri)
+        qr.add_data(self.provisioning_uri(email, secret, issuer))
         qr.make(fit=True)
         
-        img = qr.make_image(fill_color="black", back_color="white")
+        # SVG paths are written as text, skipping PIL rasterization and PNG compression
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
         buf = io.BytesIO()
-        img.save(buf, format="PNG")
+        img.save(buf)
         
-        return base64.b64encode(buf.getvalue()).decode()
+        return buf.getvalue()
+    
+    def generate_qr_code(self, email: str, secret: str, issuer: str = "SecureApp") -> str:
+        """Generate QR code for TOTP setup (base64-encoded SVG, for JSON responses)"""
+        return base64.b64encode(self.generate_qr_code_bytes(email, secret, issuer)).decode()
     
     def generate_backup_codes(self, count: int = 10) -> List[str]:
         """Generate backup recovery codes"""
-        return [secrets.token_hex(4).upper() for _ in range(count)]
+        # One read from the OS RNG and one hex conversion for the whole set
+        digits = secrets.token_bytes(4 * count).hex().upper()
+        return [digits[i:i + 8] for i in range(0, 8 * count, 8)]
+    
+    @staticmethod
+    def _backup_code_digest(code: str) -> str:
+        return hashlib.blake2b(code.encode(), digest_size=16, key=_PEPPER).hexdigest()
     
     def hash_backup_codes(self, codes: List[str]) -> str:
-        """Hash backup codes for secure storage"""
-        codes_string = ",".join(sorted(codes))
-        return hashlib.sha256(codes_string.encode()).hexdigest()
+        """Hash backup codes for secure storage (comma-separated keyed BLAKE2b digests)"""
+        return ",".join(self._backup_code_digest(code) for code in codes)
 
 class JWTManager:
     """Secure JWT token management"""
     
+    @staticmethod
+    def _encode(payload: Dict[str, Any]) -> str:
+        """Sign an HS256 JWT with the precomputed header and integer timestamps"""
+        signing_input = _JWT_HEADER_SEGMENT + b"." + _b64url(json.dumps(payload, separators=(",", ":")).encode())
+        signature = hmac.new(_SIGNING_KEY, signing_input, hashlib.sha256).digest()
+        return (signing_input + b"." + _b64url(signature)).decode()
+    
     @staticmethod
     def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
         to_encode = data.copy()
+        now = int(time.time())
         
         if expires_delta:
-            expire = datetime.now(timezone.utc) + expires_delta
+            expire = now + int(expires_delta.total_seconds())
         else:
-            expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+            expire = now + ACCESS_TOKEN_EXPIRE_MINUTES * 60
         
         to_encode.update({
             "exp": expire,
-            "iat": datetime.now(timezone.utc),
+            "iat": now,
             "type": "access"
         })
         
-        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        return JWTManager._encode(to_encode)
     
     @staticmethod
     def create_refresh_token(data: Dict[str, Any]) -> str:
         to_encode = data.copy()
-        expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        now = int(time.time())
+        expire = now + REFRESH_TOKEN_EXPIRE_DAYS * 86400
         
         to_encode.update({
             "exp": expire,
-            "iat": datetime.now(timezone.utc),
+            "iat": now,
             "type": "refresh"
         })
         
-        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        return JWTManager._encode(to_encode)
     
     @staticmethod
     def decode_token(token: str) -> Dict[str, Any]:
+        token_digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        payload = decoded_token_cache.get(token_digest)
+        if payload is not None:
+            return payload
+        
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = jwt.decode(
+                token,
+                _SIGNING_KEY,
+                algorithms=[ALGORITHM],
+                options={"require": ["exp", "iat", "sub", "type"]}
+            )
+            if payload["exp"] - time.time() > TOKEN_CACHE_EXP_MARGIN:
+                decoded_token_cache[token_digest] = payload
             return payload
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail="Token expired")
@@ -229,57 +517,233 @@ class JWTManager:
             raise HTTPException(status_code=401, detail="Invalid token")
 
 class RateLimiter:
-    """Rate limiting for authentication attempts"""
+    """Rate limiting for authentication attempts
+    
+    With Redis, attempts are counted in per-minute buckets
+    ("rl:<identifier>:<minute>") and a window is the sum of its buckets, so a
+    check is one MGET and a record is one INCR+EXPIRE pipeline. Redis errors
+    fail open to the in-process lists.
+    """
     
     @staticmethod
-    def is_rate_limited(identifier: str, max_attempts: int = 5, window_minutes: int = 15) -> bool:
-        now = time.time()
-        attempts = failed_attempts[identifier]
+    def _bucket_keys(identifier: str, window_minutes: int, minute: int) -> List[str]:
+        return [f"rl:{identifier}:{m}" for m in range(minute - window_minutes + 1, minute + 1)]
+    
+    @staticmethod
+    def _local_count(identifier: str, window_minutes: int, now: float) -> int:
+        attempts = failed_attempts.get(identifier)
+        if not attempts:
+            return 0
         
-        # Clean old attempts
+        # Timestamps are appended in order, so old attempts are always at the head
         window_seconds = window_minutes * 60
-        attempts[:] = [attempt for attempt in attempts if now - attempt < window_seconds]
+        while attempts and now - attempts[0] >= window_seconds:
+            attempts.popleft()
+        if not attempts:
+            del failed_attempts[identifier]
         
-        return len(attempts) >= max_attempts
+        return len(attempts)
     
     @staticmethod
-    def record_failed_attempt(identifier: str):
-        failed_attempts[identifier].append(time.time())
+    def _check_max_attempts(max_attempts: int):
+        if max_attempts > RATE_LIMIT_MAX_TRACKED:
+            raise ValueError(
+                f"max_attempts={max_attempts} exceeds RATE_LIMIT_MAX_TRACKED={RATE_LIMIT_MAX_TRACKED}"
+            )
+    
+    @staticmethod
+    async def is_rate_limited(identifier: str, max_attempts: int = 5, window_minutes: int = 15) -> bool:
+        return (await RateLimiter.check_many([(identifier, max_attempts, window_minutes)]))[0]
+    
+    @staticmethod
+    async def check_many(limits: List[Tuple[str, int, int]]) -> List[bool]:
+        """Check several (identifier, max_attempts, window_minutes) limits in one call"""
+        for _, max_attempts, _ in limits:
+            RateLimiter._check_max_attempts(max_attempts)
+        now = time.time()
+        
+        if redis_client is not None:
+            minute = int(now) // 60
+            key_groups = [
+                RateLimiter._bucket_keys(identifier, window_minutes, minute)
+                for identifier, _, window_minutes in limits
+            ]
+            try:
+                counts = await redis_client.mget([key for keys in key_groups for key in keys])
+            except Exception as e:
+                logger.warning(f"Redis rate limit check failed, using in-process counters: {e}")
+            else:
+                results = []
+                offset = 0
+                for (_, max_attempts, _), keys in zip(limits, key_groups):
+                    window_counts = counts[offset:offset + len(keys)]
+                    offset += len(keys)
+                    results.append(sum(int(c) for c in window_counts if c) >= max_attempts)
+                return results
+        
+        return [
+            RateLimiter._local_count(identifier, window_minutes, now) >= max_attempts
+            for identifier, max_attempts, window_minutes in limits
+        ]
+    
+    @staticmethod
+    async def record_failed_attempt(identifier: str):
+        await RateLimiter.record_many([identifier])
+    
+    @staticmethod
+    async def record_many(identifiers: List[str]):
+        """Record one failed attempt against each identifier"""
+        now = time.time()
+        
+        if redis_client is not None:
+            minute = int(now) // 60
+            try:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for identifier in identifiers:
+                        key = f"rl:{identifier}:{minute}"
+                        pipe.incr(key)
+                        pipe.expire(key, RATE_LIMIT_BUCKET_TTL)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning(f"Redis rate limit record failed, using in-process counters: {e}")
+        
+        for identifier in identifiers:
+            failed_attempts[identifier].append(now)
+    
+    @staticmethod
+    async def hit(identifier: str, max_attempts: int, window_minutes: int) -> bool:
+        """Record an attempt and report whether the limit was already reached
+        
+        With Redis the increment and the window read go out in one pipeline,
+        so concurrent attempts can't both read a count below the limit.
+        """
+        RateLimiter._check_max_attempts(max_attempts)
+        now = time.time()
+        
+        if redis_client is not None:
+            minute = int(now) // 60
+            keys = RateLimiter._bucket_keys(identifier, window_minutes, minute)
+            try:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.incr(keys[-1])
+                    pipe.expire(keys[-1], RATE_LIMIT_BUCKET_TTL)
+                    pipe.mget(keys)
+                    _, _, counts = await pipe.execute()
+                # The count includes this attempt
+                return sum(int(c) for c in counts if c) > max_attempts
+            except Exception as e:
+                logger.warning(f"Redis rate limit hit failed, using in-process counters: {e}")
+        
+        if RateLimiter._local_count(identifier, window_minutes, now) >= max_attempts:
+            return True
+        failed_attempts[identifier].append(now)
+        return False
 
 class SecurityLogger:
-    """Security event logging"""
+    """Security event logging
+    
+    Events are queued in memory and written in multi-row INSERT batches by a
+    background worker, so the audit write is not part of the response time.
+    A batch is written once it reaches BATCH_SIZE events or FLUSH_INTERVAL
+    seconds after its first event, whichever comes first.
+    """
+    
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 1.0
+    
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
     
-    @staticmethod
     def log_security_event(
-        db: Session,
-        user_id: Optional[str],
+        self,
+        user_id: Optional[uuid.UUID],
         event_type: str,
         request: Request,
         details: Optional[str] = None
     ):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait({
+            "user_id": user_id,
+            "event_type": event_type,
+            "ip_address": SecurityLogger._get_client_ip(request),
+            "user_agent": request.headers.get("User-Agent"),
+            "details": details,
+            # Stamped here rather than by the server default, which would
+            # record when the batch was written
+            "timestamp": datetime.now(timezone.utc)
+        })
+    
+    def start(self):
+        """Start the background writer (call from the app lifespan)"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Flush queued events and stop the background writer"""
+        if not self._worker:
+            return
+        await self._queue.join()
+        self._worker.cancel()
         try:
-            event = SecurityEvent(
-                user_id=user_id,
-                event_type=event_type,
-                ip_address=SecurityLogger._get_client_ip(request),
-                user_agent=request.headers.get("User-Agent"),
-                details=details
-            )
-            db.add(event)
-            db.commit()
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._drain([await self._queue.get()])
+            deadline = loop.time() + self.FLUSH_INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                self._drain(batch)
+            await self._write_batch(batch)
+            for _ in batch:
+                self._queue.task_done()
+    
+    def _drain(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        while len(batch) < self.BATCH_SIZE and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+    
+    async def _write_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            async with SessionLocal() as db:
+                await db.execute(insert(SecurityEvent), batch)
+                await db.commit()
         except Exception as e:
-            logger.error(f"Failed to log security event: {e}")
+            logger.error(f"Failed to log {len(batch)} security events: {e}")
     
     @staticmethod
     def _get_client_ip(request: Request) -> str:
         """Extract real client IP considering proxies"""
-        forwarded_for = request.headers.get("X-Forwarded-For")
+        # One pass over the raw ASGI headers (names are already lowercase)
+        forwarded_for = real_ip = None
+        for name, value in request.scope["headers"]:
+            if name == b"x-forwarded-for":
+                if forwarded_for is None:
+                    forwarded_for = value
+                    if value:
+                        break  # Takes precedence over X-Real-IP
+            elif name == b"x-real-ip" and real_ip is None:
+                real_ip = value
+        
         if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
+            return forwarded_for.split(b",", 1)[0].strip().decode("latin-1")
         
-        real_ip = request.headers.get("X-Real-IP")
         if real_ip:
-            return real_ip
+            return real_ip.decode("latin-1")
         
         return request.client.host if request.client else "unknown"
 
@@ -291,29 +755,112 @@ jwt_manager = JWTManager()
 rate_limiter = RateLimiter()
 security_logger = SecurityLogger()
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), 
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user with comprehensive validation"""
+def warmup():
+    """Exercise the crypto paths once so their lazy setup (OpenSSL/cffi
+    bindings, PyJWT's algorithm registry) happens before the first request
+    
+    Called from the app lifespan, i.e. in each worker after it is forked.
+    """
+    try:
+        token = jwt_manager.create_access_token({"sub": "warmup"})
+        jwt.decode(token, _SIGNING_KEY, algorithms=[ALGORITHM])
+        totp_manager.decrypt_secret(totp_manager.encrypt_secret(pyotp.random_base32()))
+        fernet.decrypt(fernet.encrypt(b"warmup"))
+        totp_manager._hotp(totp_manager._hmac_sha1_contexts(b"warmup"), 0)
+        totp_manager.hash_backup_codes(["WARMUP00"])
+        secure_hasher.verify_password("warmup", DUMMY_PASSWORD_HASH)
+        bcrypt.checkpw(b"warmup", bcrypt.hashpw(b"warmup", bcrypt.gensalt(rounds=4)))
+    except Exception as e:
+        logger.warning(f"Crypto warmup failed: {e}")
+
+def invalidate_user_cache(user_id: uuid.UUID):
+    """Drop cached auth state for a user (lock, unlock, logout)"""
+    user_lock_cache.pop(user_id, None)
+
+def invalidate_totp_cache(user_id: uuid.UUID):
+    """Drop a user's cached TOTP key state (logout, MFA setup/disable)"""
+    totp_context_cache.pop(user_id, None)
+
+def token_subject(payload: Dict[str, Any]) -> uuid.UUID:
+    """User id from a decoded token's sub claim, as bound to users.id"""
+    try:
+        return uuid.UUID(payload["sub"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+
+def access_token_subject(token: str) -> uuid.UUID:
+    """Validate an access token and return its subject (user id)"""
+    payload = jwt_manager.decode_token(token)
+    
+    # Validate token type
+    if payload.get("type") != "access":
+        raise HTTPException(status_code=401, detail="Invalid token type")
+    
+    return token_subject(payload)
+
+def _lock_state(locked_until: Optional[datetime]) -> Optional[float]:
+    """Cached form of account_locked_until"""
+    return epoch_seconds(locked_until) if locked_until else None
+
+def _ensure_not_locked(locked_until: Optional[float]):
+    if locked_until and locked_until > time.time():
+        raise HTTPException(status_code=423, detail="Account is temporarily locked")
+
+def _request_user_id(request: Request) -> uuid.UUID:
+    """User id resolved from the bearer token by AuthMiddleware"""
+    user_id = request.scope.get("user_id")
+    if user_id is None:
+        raise request.scope.get("auth_error") or HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return user_id
+
+async def get_current_user_id(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    _: None = Security(oauth2_scheme)
+) -> uuid.UUID:
+    """Get current authenticated user id, using the cached lock state when available"""
     try:
-        payload = jwt_manager.decode_token(token)
+        user_id = _request_user_id(request)
+        
+        locked_until = user_lock_cache.get(user_id, _MISSING)
+        if locked_until is _MISSING:
+            row = (await db.execute(_USER_LOCK_BY_ID, {"user_id": user_id})).first()
+            if not row:
+                raise HTTPException(status_code=401, detail="User not found")
+            locked_until = user_lock_cache[user_id] = _lock_state(row.account_locked_until)
+        
+        _ensure_not_locked(locked_until)
         
-        # Validate token type
-        if payload.get("type") != "access":
-            raise HTTPException(status_code=401, detail="Invalid token type")
+        return user_id
         
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Token validation error: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+async def get_current_user(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    _: None = Security(oauth2_scheme)
+) -> User:
+    """Get current authenticated user with comprehensive validation"""
+    try:
+        user_id = _request_user_id(request)
         
-        user = db.query(User).filter(User.id == user_id).first()
+        # Goes through execute() so a stale pooled connection is retried
+        result = await db.execute(_CURRENT_USER_BY_ID, {"user_id": user_id})
+        user = result.scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         
+        locked_until = user_lock_cache[user_id] = _lock_state(user.account_locked_until)
         # Check if account is locked
-        if user.account_locked_until and user.account_locked_until > datetime.now(timezone.utc):
-            raise HTTPException(status_code=423, detail="Account is temporarily locked")
+        _ensure_not_locked(locked_until)
         
         return user
         